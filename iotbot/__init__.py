@@ -24,6 +24,7 @@ github.com/xiyaowong/python-iotbot
 
 from . import refine as refine_message  # 兼容旧版本，以后可能删除
 from .action import Action
+from .async_client import AsyncIOTBOT
 from .client import IOTBOT
 from .model import EventMsg, FriendMsg, GroupMsg
 
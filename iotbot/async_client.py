@@ -0,0 +1,155 @@
+import asyncio
+import inspect
+import sys
+
+import socketio
+
+from .client import IOTBOT
+from .logger import logger
+
+
+class AsyncIOTBOT(IOTBOT):
+    """基于 asyncio 的 IOTBOT，参数与 IOTBOT 一致
+
+    接收函数可以是协程函数，协程函数直接在事件循环中运行，
+    普通函数仍然放到线程池中运行，需要安装 aiohttp
+    """
+
+    _logger_modules = (*IOTBOT._logger_modules, __name__)
+
+    ########################################################################
+    # about socketio
+    ########################################################################
+    async def connect(self):
+        logger.success('Connected to the server successfully!')
+
+        # GetWebConn
+        for qq in self.qq:
+            await self.socketio.emit(
+                'GetWebConn',
+                str(qq),
+                callback=lambda x: logger.info(
+                    f'GetWebConn -> {qq} => {x}'  # pylint: disable=cell-var-from-loop
+                ),
+            )
+
+        self._start_scheduler()
+        # 钩子函数可以是协程函数
+        result = self._call_when_connected()
+        if inspect.isawaitable(result):
+            await result
+
+    async def disconnect(self):
+        logger.warning('Disconnected to the server!')
+        # 钩子函数可以是协程函数
+        result = self._call_when_disconnected()
+        if inspect.isawaitable(result):
+            await result
+
+    def _initialize_socketio(self):
+        self.__loop = asyncio.new_event_loop()
+        # 在事件循环中调用 close 时记录退出码，由 run 在事件循环结束后退出
+        self.__exit_status = 0
+        self.socketio = socketio.AsyncClient()
+        self.socketio.event()(self.connect)
+        self.socketio.event()(self.disconnect)
+
+    async def aclose(self, status=0):
+        """在协程中断开连接，事件循环结束后程序以 status 退出"""
+        self.__exit_status = status
+        await self.socketio.disconnect()
+
+    def close(self, status=0):
+        loop = self.__loop
+        if loop.is_running():
+            # 在接收函数或钩子函数中调用，不能阻塞事件循环，交给 aclose 处理
+            asyncio.run_coroutine_threadsafe(self.aclose(status), loop)
+            return
+        if not loop.is_closed():
+            loop.run_until_complete(self.socketio.disconnect())
+            loop.close()
+        self._exit_event.set()
+        self._executor.shutdown(wait=False)
+        sys.exit(status)
+
+    def run(self):
+        logger.info('Connecting to the server...')
+        asyncio.set_event_loop(self.__loop)
+        try:
+            self.__loop.run_until_complete(
+                self.socketio.connect(
+                    f'{self.host}:{self.port}', transports=['websocket']
+                )
+            )
+        except Exception:
+            import traceback  # pylint:disable=import-outside-toplevel
+
+            logger.error(traceback.format_exc())
+            self.close(1)
+        else:
+            try:
+                self.__loop.run_until_complete(self.socketio.wait())
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.close(self.__exit_status)
+
+    ########################################################################
+    # message handler
+    ########################################################################
+    @logger.catch
+    def __task_callback(self, task):
+        task_exception = task.exception()
+        if task_exception:
+            raise task_exception
+
+    @staticmethod
+    async def __await(awaitable):
+        return await awaitable
+
+    def __call_in_executor(self, receiver, ctx):
+        # 被装饰器包装过的协程函数看起来是普通函数，调用后才能知道返回的是不是协程
+        result = receiver(ctx)
+        if inspect.isawaitable(result):
+            asyncio.run_coroutine_threadsafe(
+                self.__await(result), self.__loop
+            ).add_done_callback(self.__task_callback)
+
+    def _initialize_dispatcher(self):
+        # 消息直接在事件循环中处理，不需要分发线程
+        pass
+
+    def _make_handler(self, msg_type: str):
+        pipelines = self._pipelines
+        loop = self.__loop
+        executor = self._executor
+        callback = self.__task_callback
+        create_task = loop.create_task
+        run_in_executor = loop.run_in_executor
+        iscoroutinefunction = inspect.iscoroutinefunction
+        call_in_executor = self.__call_in_executor
+
+        async def handler(msg):
+            result = pipelines[msg_type](msg)
+            if result is None:
+                return
+            receivers, context = result
+            if not receivers:
+                return
+            # 最后一个接收函数直接使用原对象，少复制一次
+            copy_context = context._copy  # pylint: disable=protected-access
+            contexts = [copy_context() for _ in receivers[:-1]]
+            contexts.append(context)
+            for receiver, ctx in zip(receivers, contexts):
+                if iscoroutinefunction(receiver):
+                    task = create_task(receiver(ctx))
+                else:
+                    task = run_in_executor(executor, call_in_executor, receiver, ctx)
+                task.add_done_callback(callback)
+
+        return handler
+
+    def __repr__(self):
+        return 'AsyncIOTBOT <{}> <host-{}> <port-{}>'.format(
+            " ".join([str(i) for i in self.qq]), self.host, self.port
+        )
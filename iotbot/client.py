@@ -1,14 +1,13 @@
-import copy
-import functools
+import os
 import sys
-import time
-import traceback
-from collections.abc import Sequence
+import threading
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
-from typing import Callable, List, Tuple, Union
+from operator import attrgetter
+from typing import Callable, Deque, Dict, FrozenSet, Iterable, List, Tuple, Union
 
 import socketio
-from schedule import Scheduler as _Scheduler
+from schedule import Job, Scheduler
 
 from .config import config
 from .logger import logger
@@ -16,17 +15,25 @@ from .model import EventMsg, FriendMsg, GroupMsg, model_map
 from .plugin import PluginManager
 from .typing import EventMsgReceiver, FriendMsgReceiver, GroupMsgReceiver
 
+# 一条消息的接收函数数量不超过该值时，所有接收函数放在同一个线程中依次执行
+# 以减少向线程池提交任务的开销，超过时则每个接收函数单独提交，保证并行
+_BATCH_THRESHOLD = 4
+
+
+class _Job(Job):
+    def run(self):
+        logger.opt(lazy=True).info('Running task => {}', self.__job_func_name)
+        return super().run()
+
+    def __job_func_name(self):
+        if hasattr(self.job_func, '__name__'):
+            return self.job_func.__name__
+        return repr(self.job_func)
 
-def _deco_creater(bind_type):
-    def deco(self, func):
-        if bind_type == 'OnGroupMsgs':
-            self.add_group_msg_receiver(func)
-        elif bind_type == 'OnFriendMsgs':
-            self.add_friend_msg_receiver(func)
-        else:
-            self.add_event_receiver(func)
 
-    return deco
+class _Scheduler(Scheduler):
+    def every(self, interval=1):
+        return _Job(interval, self)
 
 
 class IOTBOT:  # pylint: disable = too-many-instance-attributes
@@ -40,8 +47,12 @@ class IOTBOT:  # pylint: disable = too-many-instance-attributes
     :param log_file: 是否输出文件日志
     :param port: 运行端口
     :param host: ip，需要包含schema
+    :param max_workers: 线程池最大线程数，默认为 min(32, cpu 核数 + 4)
     """
 
+    # log=False 时需要关闭日志的模块，子类在其他模块中时需要加上所在模块
+    _logger_modules: Tuple[str, ...] = (__name__,)
+
     def __init__(
         self,
         qq: Union[int, List[int]],
@@ -53,20 +64,30 @@ class IOTBOT:  # pylint: disable = too-many-instance-attributes
         log_file: bool = True,
         port: int = 8888,
         host: str = 'http://127.0.0.1',
+        max_workers: int = None,
     ):
-        if isinstance(qq, Sequence):
-            self.qq = list(qq)
-        else:
-            self.qq = [qq]
+        # 字符串也是 Sequence，所以这里只接受列表或元组
+        self.qq = tuple(qq) if isinstance(qq, (list, tuple)) else (qq,)
+        # 便于判断某个QQ是否属于本机器人
+        self._qq_set = frozenset(self.qq)
         self.use_plugins = use_plugins
         self.plugin_dir = plugin_dir
         self.host = config.host or host
         self.port = config.port or port
-        self.group_blacklist = set(config.group_blacklist or group_blacklist or [])
-        self.friend_blacklist = set(config.friend_blacklist or friend_blacklist or [])
+        self.__group_blacklist = frozenset(
+            config.group_blacklist or group_blacklist or []
+        )
+        self.__friend_blacklist = frozenset(
+            config.friend_blacklist or friend_blacklist or []
+        )
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
 
         # 作为程序是否应该退出的标志，以便后续用到，如定时任务
-        self._exit = False
+        self._exit_event = threading.Event()
+
+        # socketio 收到的消息先放入这里，由分发线程取出处理
+        self._inbox: Deque[Tuple[str, dict]] = deque()
+        self._inbox_evt = threading.Event()
 
         if log:
             if log_file:
@@ -77,7 +98,8 @@ class IOTBOT:  # pylint: disable = too-many-instance-attributes
                     encoding='utf-8',
                 )
         else:
-            logger.disable(__name__)
+            for module in self._logger_modules:
+                logger.disable(module)
 
         # 用于定时任务
         self.scheduler = _Scheduler()
@@ -97,12 +119,19 @@ class IOTBOT:  # pylint: disable = too-many-instance-attributes
             self.__event_receivers_from_hand.append(webhook.receive_events)
 
         # 消息上下文对象中间件
-        self.__friend_context_middleware: Callable[[FriendMsg], FriendMsg] = None
-        self.__group_context_middleware: Callable[[GroupMsg], GroupMsg] = None
-        self.__event_context_middleware: Callable[[EventMsg], EventMsg] = None
+        # 可以注册多个，按注册顺序依次执行
+        self.__context_middlewares: Dict[str, List[Callable]] = {
+            'OnFriendMsgs': [],
+            'OnGroupMsgs': [],
+            'OnEvents': [],
+        }
 
         # 插件管理
         self.plugMgr = PluginManager(self.plugin_dir)
+        # 所有消息接收函数的缓存，只在接收函数或插件变动时更新
+        self.__receivers_cache: Dict[str, tuple] = {}
+        self.__refresh_receivers()
+        self.plugMgr.on_change(self.__refresh_receivers)
         if use_plugins:
             self.plugMgr.load_plugins()
             print(self.plugin_status)
@@ -114,9 +143,10 @@ class IOTBOT:  # pylint: disable = too-many-instance-attributes
         self.__when_disconnected_do: Tuple[Callable, bool] = None
 
         # 依次各种初始化
-        self.__initialize_socketio()
+        self._initialize_socketio()
         self.__refresh_executor()
         self.__initialize_handlers()
+        self._initialize_dispatcher()
 
     ########################################################################
     # shortcuts to call plugin manager methods
@@ -166,43 +196,30 @@ class IOTBOT:  # pylint: disable = too-many-instance-attributes
     ########################################################################
     def _run_padding(self):
         logger.info(f'{len(self.scheduler.jobs)} tasks that are scheduled to run.')
-        while True:
-            # 定时任务不是主角，所以必须其他工作正常才运行
-            if self._exit:
+        s = self.scheduler
+        run_pending = s.run_pending
+        is_exit = self._exit_event.is_set
+        wait = self._exit_event.wait
+        # 定时任务不是主角，所以必须其他工作正常才运行
+        while not is_exit():
+            run_pending()
+            if not s.jobs:
                 return
-            s = self.scheduler
-            runnable_jobs = (job for job in s.jobs if job.should_run)
-            for job in sorted(runnable_jobs):
-                if hasattr(job.job_func, '__name__'):
-                    job_func_name = job.job_func.__name__
-                else:
-                    job_func_name = repr(job.job_func)
-                logger.info('Running task => %s' % job_func_name)
-                s._run_job(job)  # pylint: disable=protected-access
-            # 避免不必要的循环
-            # 因为定时任务间隔都很长，进入延时后并不能很好的判断self._exit来退出
-            # 所以这里每次只延时`delay`秒就判断一次是否应该退出
-            delay = 5
-            t = int(s.idle_seconds - 5)  # 延时不是必要的，减去5s抵消下面的时间消耗
-            if t <= 0:
-                continue
-            for _ in range(t // delay):
-                if self._exit:
-                    return
-                time.sleep(delay)
+            # 一直等到下一个任务需要运行，程序退出时会立即被唤醒
+            wait(max(s.idle_seconds, 0))
 
     ##########################################################################
     # decorators for registering hook function when connected or disconnected
     ##########################################################################
     def when_connected(self, func: Callable = None, *, every_time=False):
         if func is None:
-            return functools.partial(self.when_connected, every_time=every_time)
+            return lambda f: self.when_connected(f, every_time=every_time)
         self.__when_connected_do = (func, every_time)
         return None
 
     def when_disconnected(self, func: Callable = None, *, every_time=False):
         if func is None:
-            return functools.partial(self.when_disconnected, every_time=every_time)
+            return lambda f: self.when_disconnected(f, every_time=every_time)
         self.__when_disconnected_do = (func, every_time)
         return None
 
@@ -222,6 +239,14 @@ class IOTBOT:  # pylint: disable = too-many-instance-attributes
                 ),
             )
 
+        self._start_scheduler()
+        self._call_when_connected()
+
+    def disconnect(self):
+        logger.warning('Disconnected to the server!')
+        self._call_when_disconnected()
+
+    def _start_scheduler(self):
         # 启动定时任务
         if len(self.scheduler.jobs) != 0 and not getattr(
             # 服务端断线之后，socketio会自动重连，此时线程池没有关，重连成功后
@@ -230,34 +255,39 @@ class IOTBOT:  # pylint: disable = too-many-instance-attributes
             'started',
             False,
         ):
-            self.__executor.submit(self._run_padding).add_done_callback(
+            self._executor.submit(self._run_padding).add_done_callback(
                 self.__thread_pool_callback
             )
             self.scheduler.started = True
 
+    def _call_when_connected(self):
         # 连接成功执行用户定义的函数，如果有
         if self.__when_connected_do is not None:
-            self.__when_connected_do[0]()
+            result = self.__when_connected_do[0]()
             if not self.__when_connected_do[1]:  # 如果不需要每次运行，这里运行一次后就废弃设定的函数
                 self.__when_connected_do = None
+            return result
+        return None
 
-    def disconnect(self):
-        logger.warning('Disconnected to the server!')
+    def _call_when_disconnected(self):
         # 断开连接后执行用户定义的函数，如果有
         if self.__when_disconnected_do is not None:
-            self.__when_disconnected_do[0]()
+            result = self.__when_disconnected_do[0]()
             if not self.__when_disconnected_do[1]:
                 self.__when_disconnected_do = None
+            return result
+        return None
 
-    def __initialize_socketio(self):
+    def _initialize_socketio(self):
         self.socketio = socketio.Client()
         self.socketio.event()(self.connect)
         self.socketio.event()(self.disconnect)
 
     def close(self, status=0):
         self.socketio.disconnect()
-        self.__executor.shutdown(wait=False)
-        self._exit = True
+        self._exit_event.set()
+        self._inbox_evt.set()
+        self._executor.shutdown(wait=False)
         sys.exit(status)
 
     def run(self):
@@ -265,6 +295,8 @@ class IOTBOT:  # pylint: disable = too-many-instance-attributes
         try:
             self.socketio.connect(f'{self.host}:{self.port}', transports=['websocket'])
         except Exception:
+            import traceback  # pylint:disable=import-outside-toplevel
+
             logger.error(traceback.format_exc())
             self.close(1)
         else:
@@ -279,24 +311,8 @@ class IOTBOT:  # pylint: disable = too-many-instance-attributes
     # initialize thread pool
     ########################################################################
     def __refresh_executor(self):
-        # 根据消息接收函数数量初始化线程池
-        self.__executor = ThreadPoolExecutor(
-            max_workers=min(
-                50,
-                len(
-                    [  # 减小数量，控制消息频率
-                        *self.plugMgr.friend_msg_receivers,
-                        *self.__friend_msg_receivers_from_hand,
-                        *self.plugMgr.group_msg_receivers,
-                        *self.__group_msg_receivers_from_hand,
-                        *self.plugMgr.event_receivers,
-                        *self.__event_receivers_from_hand,
-                        *range(3),
-                    ]
-                )
-                * 2,
-            )
-        )
+        # 默认值与 3.8 之后标准库的默认值一致，接收函数大多在等待网络请求，不必按接收函数数量分配
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
 
     ########################################################################
     # Add message receiver manually
@@ -304,65 +320,72 @@ class IOTBOT:  # pylint: disable = too-many-instance-attributes
     def add_group_msg_receiver(self, func: GroupMsgReceiver):
         '''添加群消息接收函数'''
         self.__group_msg_receivers_from_hand.append(func)
+        self.__refresh_receivers()
 
     def add_friend_msg_receiver(self, func: FriendMsgReceiver):
         '''添加好友消息接收函数'''
         self.__friend_msg_receivers_from_hand.append(func)
+        self.__refresh_receivers()
 
     def add_event_receiver(self, func: EventMsgReceiver):
         '''添加事件消息接收函数'''
         self.__event_receivers_from_hand.append(func)
+        self.__refresh_receivers()
+
+    def __refresh_receivers(self):
+        # 原地更新，消息处理函数中持有的是这个字典
+        self.__receivers_cache['OnFriendMsgs'] = (
+            *self.__friend_msg_receivers_from_hand,
+            *self.plugMgr.friend_msg_receivers,
+        )
+        self.__receivers_cache['OnGroupMsgs'] = (
+            *self.__group_msg_receivers_from_hand,
+            *self.plugMgr.group_msg_receivers,
+        )
+        self.__receivers_cache['OnEvents'] = (
+            *self.__event_receivers_from_hand,
+            *self.plugMgr.event_receivers,
+        )
 
     @property
     def receivers(self):
         '''消息处理函数数量'''
         return {
-            'friend': len(
-                (
-                    *self.plugMgr.friend_msg_receivers,
-                    *self.__friend_msg_receivers_from_hand,
-                )
-            ),
-            'group': len(
-                (
-                    *self.plugMgr.group_msg_receivers,
-                    *self.__group_msg_receivers_from_hand,
-                )
-            ),
-            'event': len(
-                (*self.plugMgr.event_receivers, *self.__event_receivers_from_hand)
-            ),
+            'friend': len(self.__receivers_cache['OnFriendMsgs']),
+            'group': len(self.__receivers_cache['OnGroupMsgs']),
+            'event': len(self.__receivers_cache['OnEvents']),
         }
 
     ########################################################################
     # context distributor
     ########################################################################
-    def __friend_context_distributor(self, context: FriendMsg):
-        for f_receiver in [
-            *self.__friend_msg_receivers_from_hand,
-            *self.plugMgr.friend_msg_receivers,
-        ]:
-            self.__executor.submit(
-                f_receiver, copy.deepcopy(context)
-            ).add_done_callback(self.__thread_pool_callback)
-
-    def __group_context_distributor(self, context: GroupMsg):
-        for g_receiver in [
-            *self.__group_msg_receivers_from_hand,
-            *self.plugMgr.group_msg_receivers,
-        ]:
-            self.__executor.submit(
-                g_receiver, copy.deepcopy(context)
-            ).add_done_callback(self.__thread_pool_callback)
-
-    def __event_context_distributor(self, context: EventMsg):
-        for e_receiver in [
-            *self.__event_receivers_from_hand,
-            *self.plugMgr.event_receivers,
-        ]:
-            self.__executor.submit(
-                e_receiver, copy.deepcopy(context)
-            ).add_done_callback(self.__thread_pool_callback)
+    def __distribute(self, receivers: tuple, context):
+        if not receivers:
+            return
+        submit = self._executor.submit
+        callback = self.__thread_pool_callback
+        if len(receivers) <= _BATCH_THRESHOLD:
+            submit(self.__run_receivers, receivers, context).add_done_callback(
+                callback
+            )
+        else:
+            copy_context = context._copy  # pylint: disable=protected-access
+            # 最后一个接收函数直接使用原对象，少复制一次
+            for receiver in receivers[:-1]:
+                submit(receiver, copy_context()).add_done_callback(callback)
+            submit(receivers[-1], context).add_done_callback(callback)
+
+    @staticmethod
+    def __run_receivers(receivers: tuple, context):
+        catch = logger.catch
+        copy_context = context._copy  # pylint: disable=protected-access
+        # 最后一个接收函数直接使用原对象，只有一个接收函数时也就无需复制
+        for receiver in receivers[:-1]:
+            # 一个接收函数出错不影响后面的接收函数
+            with catch():
+                receiver(copy_context())
+        with catch():
+            receivers[-1](context)
 
     ########################################################################
     # register context middleware
@@ -371,25 +394,22 @@ class IOTBOT:  # pylint: disable = too-many-instance-attributes
         self, middleware: Callable[[FriendMsg], FriendMsg]
     ):
         """注册好友消息中间件"""
-        if self.__friend_context_middleware is not None:
-            raise Exception('Cannot register more than one middleware(friend)')
-        self.__friend_context_middleware = middleware
+        self.__context_middlewares['OnFriendMsgs'].append(middleware)
+        self.__refresh_pipeline('OnFriendMsgs')
 
     def register_group_context_middleware(
         self, middleware: Callable[[GroupMsg], GroupMsg]
     ):
         """注册群消息中间件"""
-        if self.__group_context_middleware is not None:
-            raise Exception('Cannot register more than one middleware(group)')
-        self.__group_context_middleware = middleware
+        self.__context_middlewares['OnGroupMsgs'].append(middleware)
+        self.__refresh_pipeline('OnGroupMsgs')
 
     def register_event_context_middleware(
         self, middleware: Callable[[EventMsg], EventMsg]
     ):
         """注册事件消息中间件"""
-        if self.__event_context_middleware is not None:
-            raise Exception('Cannot register more than one middleware(event)')
-        self.__event_context_middleware = middleware
+        self.__context_middlewares['OnEvents'].append(middleware)
+        self.__refresh_pipeline('OnEvents')
 
     ########################################################################
     # message handler
@@ -400,58 +420,143 @@ class IOTBOT:  # pylint: disable = too-many-instance-attributes
         if worker_exception:
             raise worker_exception
 
-    def __friend_msg_handler(self, msg):
-        context: FriendMsg = model_map['OnFriendMsgs'](msg)
-        logger.info(f'{context.__class__.__name__} ->  {context.data}')
-        # 黑名单
-        if context.FromUin in self.friend_blacklist:
-            return
-        # 中间件
-        if self.__friend_context_middleware is not None:
-            new_context = self.__friend_context_middleware(context)
-            if isinstance(new_context, type(context)):
-                context = new_context
-            else:
-                return
-        self.__executor.submit(self.__friend_context_distributor, context)
+    def _make_pipeline(self, msg_type: str):
+        """根据当前的黑名单和中间件生成对应消息类型的处理函数，只包含需要的步骤
+
+        生成的函数将原始消息处理为(接收函数, 消息上下文对象)，消息被过滤时返回 None
+        """
+        model = model_map[msg_type]
+        receivers_cache = self.__receivers_cache
+        blacklist, blacklist_key = {
+            'OnFriendMsgs': (self.__friend_blacklist, attrgetter('FromUin')),
+            'OnGroupMsgs': (self.__group_blacklist, attrgetter('FromGroupId')),
+        }.get(msg_type, (None, None))
+        middlewares = self.__context_middlewares[msg_type]
 
-    def __group_msg_handler(self, msg):
-        context: GroupMsg = model_map['OnGroupMsgs'](msg)
-        logger.info(f'{context.__class__.__name__} ->  {context.data}')
+        stages = []
         # 黑名单
-        if context.FromGroupId in self.group_blacklist:
-            return
-        # 中间件
-        if self.__group_context_middleware is not None:
-            new_context = self.__group_context_middleware(context)
-            if isinstance(new_context, type(context)):
-                context = new_context
-            else:
-                return
-        self.__executor.submit(self.__group_context_distributor, context)
+        if blacklist:
 
-    def __event_msg_handler(self, msg):
-        context: EventMsg = model_map['OnEvents'](msg)
-        logger.info(f'{context.__class__.__name__} ->  {context.data}')
+            def filter_blacklist(context):
+                if blacklist_key(context) in blacklist:
+                    return None
+                return context
+
+            stages.append(filter_blacklist)
         # 中间件
-        if self.__event_context_middleware is not None:
-            new_context = self.__event_context_middleware(context)
-            if isinstance(new_context, type(context)):
-                context = new_context
-            else:
+        for middleware in middlewares:
+
+            def run_middleware(context, middleware=middleware):
+                new_context = middleware(context)
+                # refine 函数返回的是子类，同样可以继续传递
+                if new_context.__class__ is model or isinstance(new_context, model):
+                    return new_context
+                return None
+
+            stages.append(run_middleware)
+
+        # 只在日志等级允许时才格式化消息内容
+        log_info = logger.opt(lazy=True).info
+        log_format = model.__name__ + ' ->  {}'
+
+        def parse(msg):
+            context = model(msg)
+            log_info(log_format, lambda: context.data)
+            return context
+
+        if not stages:
+            return lambda msg: (receivers_cache[msg_type], parse(msg))
+
+        stages = tuple(stages)
+
+        def pipeline(msg):
+            context = parse(msg)
+            for stage in stages:
+                context = stage(context)
+                if context is None:
+                    return None
+            return receivers_cache[msg_type], context
+
+        return pipeline
+
+    def __refresh_pipeline(self, msg_type: str):
+        # 原地更新，消息处理函数中持有的是这个字典
+        self._pipelines[msg_type] = self._make_pipeline(msg_type)
+
+    def _make_handler(self, msg_type: str):
+        append = self._inbox.append
+        notify = self._inbox_evt.set
+
+        # socketio 的回调中只把消息放入队列，解析、过滤和分发都在分发线程中进行，不阻塞接收消息
+        def handler(msg):
+            append((msg_type, msg))
+            notify()
+
+        return handler
+
+    def _initialize_dispatcher(self):
+        self._dispatcher_thread = threading.Thread(
+            target=self.__dispatch_forever, name='iotbot-dispatcher', daemon=True
+        )
+        self._dispatcher_thread.start()
+
+    def __dispatch_forever(self):
+        inbox = self._inbox
+        popleft = inbox.popleft
+        wait = self._inbox_evt.wait
+        clear = self._inbox_evt.clear
+        is_exit = self._exit_event.is_set
+        pipelines = self._pipelines
+        distribute = self.__distribute
+        catch = logger.catch
+        while True:
+            wait()
+            if is_exit():
                 return
-        self.__executor.submit(self.__event_context_distributor, context)
+            # 先清除标志再取消息，取完之后新到的消息会重新设置标志，不会遗漏
+            clear()
+            while inbox:
+                msg_type, msg = popleft()
+                # 一条消息出错不影响后面的消息
+                with catch():
+                    result = pipelines[msg_type](msg)
+                    if result is not None:
+                        distribute(*result)
 
     def __initialize_handlers(self):
-        self.socketio.on('OnGroupMsgs')(self.__group_msg_handler)
-        self.socketio.on('OnFriendMsgs')(self.__friend_msg_handler)
-        self.socketio.on('OnEvents')(self.__event_msg_handler)
+        self._pipelines: Dict[str, Callable] = {}
+        for msg_type in ('OnGroupMsgs', 'OnFriendMsgs', 'OnEvents'):
+            self.__refresh_pipeline(msg_type)
+            self.socketio.on(msg_type)(self._make_handler(msg_type))
+
+    ########################################################################
+    # blacklist
+    ########################################################################
+    @property
+    def group_blacklist(self) -> FrozenSet[int]:
+        '''群黑名单'''
+        return self.__group_blacklist
+
+    @group_blacklist.setter
+    def group_blacklist(self, blacklist: Iterable[int]):
+        self.__group_blacklist = frozenset(blacklist)
+        self.__refresh_pipeline('OnGroupMsgs')
+
+    @property
+    def friend_blacklist(self) -> FrozenSet[int]:
+        '''好友黑名单'''
+        return self.__friend_blacklist
+
+    @friend_blacklist.setter
+    def friend_blacklist(self, blacklist: Iterable[int]):
+        self.__friend_blacklist = frozenset(blacklist)
+        self.__refresh_pipeline('OnFriendMsgs')
 
     ###########################################################################
     # decorators
-    on_group_msg = _deco_creater('OnGroupMsgs')
-    on_friend_msg = _deco_creater('OnFriendMsgs')
-    on_event = _deco_creater('OnEvents')
+    on_group_msg = add_group_msg_receiver
+    on_friend_msg = add_friend_msg_receiver
+    on_event = add_event_receiver
 
     def __repr__(self):
         return 'IOTBOT <{}> <host-{}> <port-{}>'.format(
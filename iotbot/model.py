@@ -2,7 +2,15 @@
 """消息模型，仅提取固定的字段"""
 
 
-class GroupMsg:
+class _Msg:
+    def _copy(self):
+        # 分发消息时使用，只复制属性字典，message、data 等字典与原对象共享
+        new = self.__class__.__new__(self.__class__)
+        new.__dict__ = self.__dict__.copy()
+        return new
+
+
+class GroupMsg(_Msg):
     def __init__(self, message: dict):
         self.message: dict = message
         self.CurrentQQ: int = message.get('CurrentQQ')
@@ -25,7 +33,7 @@ class GroupMsg:
         return self.message[key]
 
 
-class FriendMsg:
+class FriendMsg(_Msg):
     def __init__(self, message: dict):
         self.message: dict = message
         self.CurrentQQ: int = message.get('CurrentQQ')
@@ -47,7 +55,7 @@ class FriendMsg:
         return self.message[key]
 
 
-class EventMsg:
+class EventMsg(_Msg):
     def __init__(self, message: dict):
         self.message: dict = message
         self.CurrentQQ: int = message.get('CurrentQQ')
@@ -3,9 +3,7 @@ import os
 import re
 from pathlib import Path
 from types import ModuleType
-from typing import Dict, List
-
-from prettytable import PrettyTable
+from typing import Callable, Dict, List, Tuple
 
 from .typing import EventMsgReceiver, FriendMsgReceiver, GroupMsgReceiver
 
@@ -44,6 +42,12 @@ class PluginManager:
         self.plugin_dir = plugin_dir
         self._plugins: Dict[str, Plugin] = dict()
         self._removed_plugins: Dict[str, Plugin] = dict()
+        # 插件变动(加载、重载、停用、启用)后需要调用的函数
+        self._change_callbacks: List[Callable[[], None]] = []
+        # 接收函数的快照，只在插件变动时更新
+        self._friend_msg_receivers: Tuple[FriendMsgReceiver, ...] = ()
+        self._group_msg_receivers: Tuple[GroupMsgReceiver, ...] = ()
+        self._event_receivers: Tuple[EventMsgReceiver, ...] = ()
 
         # 本地缓存的停用的插件名称列表
         self._load_removed_plugin_names()
@@ -69,6 +73,29 @@ class PluginManager:
         with open('.REMOVED_PLUGINS', 'w', encoding='utf8') as f:
             json.dump(data, f, ensure_ascii=False)
 
+    def on_change(self, callback: Callable[[], None]) -> None:
+        '''register a callback which will be called after plugins changed'''
+        self._change_callbacks.append(callback)
+
+    def _changed(self):
+        self._friend_msg_receivers = tuple(
+            plugin.receive_friend_msg
+            for plugin in self._plugins.values()
+            if plugin.receive_friend_msg
+        )
+        self._group_msg_receivers = tuple(
+            plugin.receive_group_msg
+            for plugin in self._plugins.values()
+            if plugin.receive_group_msg
+        )
+        self._event_receivers = tuple(
+            plugin.receive_events
+            for plugin in self._plugins.values()
+            if plugin.receive_events
+        )
+        for callback in self._change_callbacks:
+            callback()
+
     def load_plugins(self, plugin_dir: str = None) -> None:
         if plugin_dir is None:
             plugin_dir = self.plugin_dir
@@ -84,6 +111,7 @@ class PluginManager:
                 self._removed_plugins[plugin.name] = plugin
             else:
                 self._plugins[plugin.name] = plugin
+        self._changed()
 
     def refresh(self, plugin_dir: str = None) -> None:
         '''reload all plugins'''
@@ -99,6 +127,7 @@ class PluginManager:
         self.load_plugins(plugin_dir)
         # tidy
         self._plugins.update(old_plugins)
+        self._changed()
 
     def reload_plugin(self, plugin_name: str) -> None:
         """reload one plugin according to plugin name
@@ -106,6 +135,7 @@ class PluginManager:
         """
         if plugin_name in self._plugins:
             self._plugins[plugin_name].reload()
+            self._changed()
 
     def remove_plugin(self, plugin_name: str) -> None:
         '''remove not delete.'''
@@ -115,6 +145,7 @@ class PluginManager:
                 # 缓存到本地
                 self._removed_plugin_names.append(plugin_name)
                 self._update_removed_plugin_names()
+                self._changed()
         except KeyError:  # 可能由self._removed_plugins[plugin_name]引发
             pass
 
@@ -126,6 +157,7 @@ class PluginManager:
                 if plugin_name in self._removed_plugin_names:
                     self._removed_plugin_names.remove(plugin_name)
                     self._update_removed_plugin_names()
+                self._changed()
         except KeyError:
             pass
 
@@ -142,32 +174,23 @@ class PluginManager:
     @property
     def friend_msg_receivers(self) -> List[FriendMsgReceiver]:
         '''funcs to handle (friend msg)context'''
-        return [
-            plugin.receive_friend_msg
-            for plugin in self._plugins.values()
-            if plugin.receive_friend_msg
-        ]
+        return list(self._friend_msg_receivers)
 
     @property
     def group_msg_receivers(self) -> List[GroupMsgReceiver]:
         '''funcs to handle (group msg)context'''
-        return [
-            plugin.receive_group_msg
-            for plugin in self._plugins.values()
-            if plugin.receive_group_msg
-        ]
+        return list(self._group_msg_receivers)
 
     @property
     def event_receivers(self) -> List[EventMsgReceiver]:
         '''funcs to handle (event msg)context'''
-        return [
-            plugin.receive_events
-            for plugin in self._plugins.values()
-            if plugin.receive_events
-        ]
+        return list(self._event_receivers)
 
     @property
     def info_table(self) -> str:
+        # 只在打印插件信息时用到
+        from prettytable import PrettyTable  # pylint:disable=import-outside-toplevel
+
         table = PrettyTable(['Receiver', 'Count', 'Info'])
         table.add_row(
             [
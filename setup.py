@@ -38,6 +38,7 @@ setup(
         'loguru >= 0.5.1',
         'schedule >= 0.6.0',
     ],
+    extras_require={'async': ['aiohttp >= 3.6.2']},
     entry_points='''
         [console_scripts]
         iotbot=iotbot.cli:cli
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from iotbot import AsyncIOTBOT
+from iotbot import decorators as deco
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    # 插件管理会在当前目录写入 .REMOVED_PLUGINS
+    monkeypatch.chdir(tmp_path)
+    bot = AsyncIOTBOT(123, log=False)
+    yield bot
+    bot._exit_event.set()
+    bot._executor.shutdown(wait=True)
+    loop = bot._AsyncIOTBOT__loop
+    if not loop.is_closed():
+        loop.close()
+
+
+def run(bot, coro):
+    return bot._AsyncIOTBOT__loop.run_until_complete(coro)
+
+
+async def wait_until(condition, timeout=3):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        await asyncio.sleep(0.01)
+    return condition()
+
+
+def send(bot, msg_type, data):
+    return bot.socketio.handlers['/'][msg_type](
+        {'CurrentQQ': 123, 'CurrentPacket': {'Data': data}}
+    )
+
+
+def test_coroutine_sync_and_wrapped_receivers(bot):
+    lock = threading.Lock()
+    received = []
+
+    def record(kind, ctx):
+        with lock:
+            received.append((kind, ctx.Content))
+
+    async def coroutine_receiver(ctx):
+        record('coroutine', ctx)
+
+    def sync_receiver(ctx):
+        record('sync', ctx)
+
+    @deco.in_content('hi')
+    async def wrapped_receiver(ctx):
+        await asyncio.sleep(0)
+        record('wrapped', ctx)
+
+    bot.on_group_msg(coroutine_receiver)
+    bot.on_group_msg(sync_receiver)
+    bot.on_group_msg(wrapped_receiver)
+
+    run(bot, send(bot, 'OnGroupMsgs', {'Content': 'hi'}))
+    run(bot, send(bot, 'OnGroupMsgs', {'Content': 'bye'}))
+
+    assert run(bot, wait_until(lambda: len(received) == 5))
+    assert sorted(received) == [
+        ('coroutine', 'bye'),
+        ('coroutine', 'hi'),
+        ('sync', 'bye'),
+        ('sync', 'hi'),
+        ('wrapped', 'hi'),
+    ]
+
+
+def test_async_hooks_awaited(bot, monkeypatch):
+    async def emit(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(bot.socketio, 'emit', emit)
+    called = []
+
+    async def on_connected():
+        await asyncio.sleep(0)
+        called.append('connected')
+
+    async def on_disconnected():
+        await asyncio.sleep(0)
+        called.append('disconnected')
+
+    bot.when_connected(on_connected)
+    bot.when_disconnected(on_disconnected)
+
+    run(bot, bot.connect())
+    run(bot, bot.disconnect())
+
+    assert called == ['connected', 'disconnected']
+
+
+def test_close_inside_loop(bot, monkeypatch):
+    stopped = None
+
+    async def connect(*args, **kwargs):
+        nonlocal stopped
+        stopped = asyncio.Event()
+        # 模拟在接收函数中调用 close
+        bot._AsyncIOTBOT__loop.call_soon(bot.close, 3)
+
+    async def wait():
+        await stopped.wait()
+
+    async def disconnect():
+        stopped.set()
+
+    monkeypatch.setattr(bot.socketio, 'connect', connect)
+    monkeypatch.setattr(bot.socketio, 'wait', wait)
+    monkeypatch.setattr(bot.socketio, 'disconnect', disconnect)
+
+    with pytest.raises(SystemExit) as exc_info:
+        bot.run()
+
+    assert exc_info.value.code == 3
+    assert bot._AsyncIOTBOT__loop.is_closed()
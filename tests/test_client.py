@@ -0,0 +1,204 @@
+import json
+import threading
+import time
+
+import pytest
+
+from iotbot import IOTBOT, GroupMsg
+from iotbot.client import _BATCH_THRESHOLD
+from iotbot.refine import refine_pic_group_msg
+
+
+def wait_until(condition, timeout=3):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def send(bot, msg_type, data):
+    bot.socketio.handlers['/'][msg_type](
+        {'CurrentQQ': 123, 'CurrentPacket': {'Data': data}}
+    )
+
+
+@pytest.fixture
+def make_bot(tmp_path, monkeypatch):
+    # 插件管理会在当前目录写入 .REMOVED_PLUGINS
+    monkeypatch.chdir(tmp_path)
+    bots = []
+
+    def make(**kwargs):
+        bot = IOTBOT(123, log=False, **kwargs)
+        bots.append(bot)
+        return bot
+
+    yield make
+    for bot in bots:
+        bot._exit_event.set()
+        bot._inbox_evt.set()
+        bot._executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def bot(make_bot):
+    return make_bot()
+
+
+def test_every_message_delivered(bot):
+    lock = threading.Lock()
+    received = []
+
+    def receiver(ctx):
+        with lock:
+            received.append(ctx.FromGroupId)
+
+    bot.on_group_msg(receiver)
+    bot.on_group_msg(receiver)
+
+    def produce(start):
+        for i in range(start, start + 2000):
+            send(bot, 'OnGroupMsgs', {'FromGroupId': i})
+
+    producers = [threading.Thread(target=produce, args=(i * 2000,)) for i in range(4)]
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+
+    assert wait_until(lambda: len(received) == 16000)
+    assert sorted(received) == sorted(list(range(8000)) * 2)
+
+
+def test_friend_and_event_messages_delivered(bot):
+    received = []
+    bot.on_friend_msg(lambda ctx: received.append(('friend', ctx.FromUin)))
+    bot.on_event(lambda ctx: received.append(('event', ctx.EventName)))
+
+    send(bot, 'OnFriendMsgs', {'FromUin': 1})
+    send(bot, 'OnEvents', {'EventName': 'ON_EVENT_X', 'EventMsg': {}})
+
+    assert wait_until(lambda: len(received) == 2)
+    assert sorted(received) == [('event', 'ON_EVENT_X'), ('friend', 1)]
+
+
+def test_blacklist_setter_rebuilds_pipeline(make_bot):
+    bot = make_bot(group_blacklist=[1], friend_blacklist=[10])
+    received = []
+    bot.on_group_msg(lambda ctx: received.append(ctx.FromGroupId))
+    bot.on_friend_msg(lambda ctx: received.append(ctx.FromUin))
+
+    for group in (1, 2):
+        send(bot, 'OnGroupMsgs', {'FromGroupId': group})
+    send(bot, 'OnFriendMsgs', {'FromUin': 10})
+    assert wait_until(lambda: received == [2])
+
+    bot.group_blacklist = [2]
+    bot.friend_blacklist = []
+    assert bot.group_blacklist == frozenset({2})
+    for group in (1, 2):
+        send(bot, 'OnGroupMsgs', {'FromGroupId': group})
+    send(bot, 'OnFriendMsgs', {'FromUin': 10})
+    assert wait_until(lambda: len(received) == 3)
+    assert sorted(received[1:]) == [1, 10]
+
+
+def test_middleware_chain(bot):
+    def first(ctx):
+        ctx.first = True
+        return ctx
+
+    def second(ctx):
+        ctx.second = ctx.first
+        return ctx
+
+    bot.register_group_context_middleware(first)
+    bot.register_group_context_middleware(second)
+    received = []
+    bot.on_group_msg(lambda ctx: received.append((ctx.first, ctx.second)))
+
+    send(bot, 'OnGroupMsgs', {'FromGroupId': 1})
+
+    assert wait_until(lambda: received == [(True, True)])
+
+
+def test_middleware_mismatch_drops_message(bot):
+    seen_by_second = []
+
+    def first(ctx):
+        return ctx if ctx.FromGroupId != 2 else None
+
+    def second(ctx):
+        seen_by_second.append(ctx.FromGroupId)
+        return ctx if ctx.FromGroupId != 3 else 'not a context'
+
+    bot.register_group_context_middleware(first)
+    bot.register_group_context_middleware(second)
+    received = []
+    bot.on_group_msg(lambda ctx: received.append(ctx.FromGroupId))
+
+    for group in (1, 2, 3, 4):
+        send(bot, 'OnGroupMsgs', {'FromGroupId': group})
+
+    assert wait_until(lambda: len(received) == 2)
+    time.sleep(0.1)
+    assert sorted(received) == [1, 4]
+    assert sorted(seen_by_second) == [1, 3, 4]
+
+
+def test_middleware_refined_context_passes(bot):
+    bot.register_group_context_middleware(lambda ctx: refine_pic_group_msg(ctx) or ctx)
+    received = []
+    bot.on_group_msg(lambda ctx: received.append(ctx.__class__.__name__))
+
+    pic_content = json.dumps({'Content': 'pic', 'GroupPic': [], 'Tips': ''})
+    send(bot, 'OnGroupMsgs', {'MsgType': 'PicMsg', 'Content': pic_content})
+    send(bot, 'OnGroupMsgs', {'MsgType': 'TextMsg', 'Content': 'text'})
+
+    assert wait_until(lambda: len(received) == 2)
+    assert sorted(received) == ['GroupMsg', '_PicGroupMsg']
+
+
+@pytest.mark.parametrize('count', [1, _BATCH_THRESHOLD, _BATCH_THRESHOLD + 2])
+def test_receivers_get_isolated_contexts(bot, count):
+    lock = threading.Lock()
+    received = {}
+
+    def make_receiver(index):
+        def receiver(ctx: GroupMsg):
+            ctx.tag = index
+            time.sleep(0.01)  # 给其他接收函数修改的机会
+            with lock:
+                received[index] = (ctx.tag, id(ctx), ctx.message)
+
+        return receiver
+
+    for index in range(count):
+        bot.on_group_msg(make_receiver(index))
+
+    send(bot, 'OnGroupMsgs', {'FromGroupId': 1})
+
+    assert wait_until(lambda: len(received) == count)
+    assert all(tag == index for index, (tag, _, _) in received.items())
+    if count > 1:
+        assert len({ctx_id for _, ctx_id, _ in received.values()}) == count
+    # 原始消息字典是共享的
+    assert len({id(message) for _, _, message in received.values()}) == 1
+
+
+def test_close_stops_dispatcher_and_scheduler(bot, monkeypatch):
+    monkeypatch.setattr(bot.socketio, 'disconnect', lambda: None)
+    bot.scheduler.every(1).hours.do(lambda: None)
+    scheduler_thread = threading.Thread(target=bot._run_padding)
+    scheduler_thread.start()
+
+    with pytest.raises(SystemExit) as exc_info:
+        bot.close(0)
+
+    assert exc_info.value.code == 0
+    bot._dispatcher_thread.join(1)
+    scheduler_thread.join(1)
+    assert not bot._dispatcher_thread.is_alive()
+    assert not scheduler_thread.is_alive()